@@ -1,5 +1,6 @@
 import logging
 import math
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -44,11 +45,14 @@ def main(config: DictConfig) -> None:
     config = utils_for_trl.setup_config_and_resuming(config, acc_state, acc_logger)
     # full_config is a merge with the TRL arg dataclasses
     # The args dataclasses are used by the HF classes, and the full_config by the template.
-    script_args = ScriptArguments(**OmegaConf.to_container(config.script_args))
+    # Convert to a native container once instead of walking the config tree
+    # for every arg dataclass (the config is already resolved in setup).
+    config_container = OmegaConf.to_container(config, resolve=True)
+    script_args = ScriptArguments(**config_container["script_args"])
     training_args = SFTConfig(
-        **OmegaConf.to_container(config.training_args), output_dir=str(Path.cwd())
+        **config_container["training_args"], output_dir=str(Path.cwd())
     )
-    model_args = ModelConfig(**OmegaConf.to_container(config.model_args))
+    model_args = ModelConfig(**config_container["model_args"])
     tokenizer_args = TokenizerConfig(
         model_name_or_path=config.tokenizer_args.tokenizer_name_or_path,
         padding_side=config.tokenizer_args.padding_side,
@@ -123,15 +127,26 @@ def main(config: DictConfig) -> None:
     # Find the last checkpoint
     resuming_dir = Path.cwd()
     # Handle resuming
+    # Use scandir to leverage the cached DirEntry type and only stat the
+    # checkpoint files of candidates newer than the best one found so far
+    # (stat calls are expensive on the cluster parallel filesystems).
     last_checkpoint_number = 0
-    for item in resuming_dir.iterdir():
-        if item.is_dir() and item.name.startswith("checkpoint-"):
-            if (item / "scheduler.pt").is_file() and (
-                item / "trainer_state.json"
-            ).is_file():
-                last_checkpoint_number = max(
-                    last_checkpoint_number, int(item.name.split("-")[-1])
-                )
+    with os.scandir(resuming_dir) as dir_entries:
+        for entry in dir_entries:
+            if not entry.name.startswith("checkpoint-") or not entry.is_dir(
+                follow_symlinks=False
+            ):
+                continue
+            try:
+                checkpoint_number = int(entry.name.rsplit("-", 1)[1])
+            except ValueError:
+                continue
+            if checkpoint_number <= last_checkpoint_number:
+                continue
+            if os.path.isfile(f"{entry.path}/scheduler.pt") and os.path.isfile(
+                f"{entry.path}/trainer_state.json"
+            ):
+                last_checkpoint_number = checkpoint_number
 
     if last_checkpoint_number > 0:
         acc_logger.info(
@@ -207,7 +222,7 @@ def main(config: DictConfig) -> None:
         if last_eval_file.exists():
             acc_logger.info("Last evaluation already performed.")
         else:
-            torch.cuda.empty_cache()
+            utils_for_trl.empty_cache_if_fragmented()
             acc_logger.info("Performing final evaluation.")
             metrics = trainer.evaluate()
             trainer.log_metrics("eval", metrics)
@@ -224,7 +239,9 @@ def main(config: DictConfig) -> None:
         wandb.finish()
         utils.config.try_sync_wandb()
     acc_state.wait_for_everyone()
-    accelerate.Accelerator().end_training()
+    # Reuse the accelerator built by the trainer instead of constructing a
+    # fresh one just to call end_training.
+    trainer.accelerator.end_training()
 
 
 if __name__ == "__main__":
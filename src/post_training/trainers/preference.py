@@ -212,8 +212,13 @@ class PreferenceTrainerCollator(DataCollatorMixin):
         # TODO: add logic to pad ref rewards for samples with different number of ref rewards
         # TODO: it would need to be taken into account in the computation of the quantile rewards in the loss function
         if self.num_ref_rewards > 0 and "ref_rewards" in examples[0]:
+            # Upcast explicitly: the dataset may store the rewards as float16.
             output["ref_rewards"] = torch.tensor(
-                [example["ref_rewards"][: self.num_ref_rewards] for example in examples]
+                [
+                    example["ref_rewards"][: self.num_ref_rewards]
+                    for example in examples
+                ],
+                dtype=torch.float32,
             )
         if "chosen_rewards" in examples[0] and "rejected_rewards" in examples[0]:
             output["chosen_rewards"] = torch.tensor(
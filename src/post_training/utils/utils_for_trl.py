@@ -4,6 +4,7 @@ import subprocess
 import sys
 from pathlib import Path
 
+import torch
 from accelerate.utils import broadcast_object_list as accelerate_broadcast_object_list
 from omegaconf import OmegaConf
 
@@ -63,3 +64,20 @@ def setup_config_and_resuming(config, acc_state, acc_logger, postprocess_func=No
         acc_logger.info(f"Resuming from the directory: {Path.cwd()}")
 
     return config
+
+
+def empty_cache_if_fragmented(threshold_bytes=2 << 30):
+    """Release cached CUDA blocks only when fragmentation is high.
+
+    `torch.cuda.empty_cache()` forces a device synchronization and hands the
+    cached blocks back to CUDA, so the next large allocation pays a fresh
+    cudaMalloc. Only do it when the allocator is actually sitting on a lot
+    of reserved-but-unallocated memory.
+    """
+    if not torch.cuda.is_available():
+        return
+    memory_stats = torch.cuda.memory_stats()
+    reserved = memory_stats.get("reserved_bytes.all.current", 0)
+    allocated = memory_stats.get("allocated_bytes.all.current", 0)
+    if reserved - allocated > threshold_bytes:
+        torch.cuda.empty_cache()
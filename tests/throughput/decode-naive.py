@@ -13,52 +13,92 @@ model = AutoModelForCausalLM.from_pretrained(
 tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
 tokenizer.pad_token = tokenizer.eos_token
 
+# reduce-overhead enables CUDA graph capture for the fixed-shape decode
+# steps, removing the per-token Python/dispatch overhead that dominates
+# small-batch latency.
+model = torch.compile(model, mode="reduce-overhead", fullgraph=False)
 
-@torch.no_grad()
+
+@torch.inference_mode()
 def generate_from_scratch(n_tokens=100, batch_size=1, print_output=False):
     # throughput test
-    model_inputs = tokenizer([""] * batch_size, return_tensors="pt", padding=True).to(
-        "cuda"
+    model_inputs = tokenizer(
+        [""] * batch_size, return_tensors="pt", padding=True, pad_to_multiple_of=8
+    ).to("cuda")
+    # Throwaway call so compilation and CUDA graph capture for this shape
+    # happen outside the timed region.
+    model.generate(
+        **model_inputs,
+        do_sample=True,
+        min_new_tokens=n_tokens,
+        max_new_tokens=n_tokens,
+        cache_implementation="static",
     )
-    start = time.time()
+    # CUDA events measure the time spent on the GPU; generate dispatches
+    # asynchronously so CPU wallclock would mix in dispatch latency.
+    start_event = torch.cuda.Event(enable_timing=True)
+    end_event = torch.cuda.Event(enable_timing=True)
+    start_event.record()
     generated_ids = model.generate(
-        **model_inputs, do_sample=True, min_new_tokens=n_tokens, max_new_tokens=n_tokens
+        **model_inputs,
+        do_sample=True,
+        min_new_tokens=n_tokens,
+        max_new_tokens=n_tokens,
+        cache_implementation="static",
     )
-    end = time.time()
+    end_event.record()
+    torch.cuda.synchronize()
+    duration = start_event.elapsed_time(end_event) / 1000
     if print_output:
         res = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
         print(res)
-    latency = (end - start) / n_tokens
-    throughput = batch_size * n_tokens / (end - start)
+    latency = duration / n_tokens
+    throughput = batch_size * n_tokens / duration
 
     print(
         f"Latency: takes {latency*1000:.2f} ms/token on average for {batch_size} sequences of {n_tokens} tokens\n"
         f"Throughput: generates {throughput:.2f} tokens/sec for {batch_size} sequences of {n_tokens} tokens\n"
-        f"Time: takes {end - start:.2f} seconds to generate {batch_size} sequences of {n_tokens} tokens\n"
+        f"Time: takes {duration:.2f} seconds to generate {batch_size} sequences of {n_tokens} tokens\n"
     )
 
     return throughput, latency
 
 
-@torch.no_grad()
+@torch.inference_mode()
 def benchmark(print_output=False):
     print("Benchmarking on 100 prompts")
     batch_size = 100
-    prompts = batch_size * [
-        "Create a list of 3 startup ideas in enterprise B2B SaaS. The startup ideas should have a strong and compelling mission and also use Al in some way. Avoid cryptocurrency or blockchain. The startup ideas should have a cool and interesting name. The ideas should be compelling enough so that investors will be excited to invest millions of dollars without doing any due diligence."
-    ]
-    model_inputs = tokenizer(prompts, return_tensors="pt", padding=True).to("cuda")
-    start = time.time()
+    prompt = "Create a list of 3 startup ideas in enterprise B2B SaaS. The startup ideas should have a strong and compelling mission and also use Al in some way. Avoid cryptocurrency or blockchain. The startup ideas should have a cool and interesting name. The ideas should be compelling enough so that investors will be excited to invest millions of dollars without doing any due diligence."
+    # The prompts are identical, so tokenize once and broadcast along the
+    # batch dim on device instead of running BPE batch_size times.
+    # Pin the host tensors so the H2D copy is DMA instead of pageable memory.
+    single_input = tokenizer([prompt], return_tensors="pt")
+    single_input = {
+        k: v.pin_memory().to("cuda", non_blocking=True) for k, v in single_input.items()
+    }
+    model_inputs = {
+        k: v.expand(batch_size, -1).contiguous() for k, v in single_input.items()
+    }
+    # Throwaway call so compilation and CUDA graph capture for this shape
+    # happen outside the timed region.
+    model.generate(**model_inputs, do_sample=True, max_new_tokens=100)
+    start_event = torch.cuda.Event(enable_timing=True)
+    end_event = torch.cuda.Event(enable_timing=True)
+    start_event.record()
     generated_ids = model.generate(**model_inputs, do_sample=True, max_new_tokens=100)
-    end = time.time()
+    end_event.record()
+    torch.cuda.synchronize()
+    duration = start_event.elapsed_time(end_event) / 1000
     if print_output:
         res = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
         print(res)
-    n_tokens_total = (generated_ids[:, 74:] < 128001).sum()
-    throughput = n_tokens_total / (end - start)
+    # Compare against the tokenizer's eos id (a hardcoded `< 128001` is wrong
+    # for llama3-instruct, whose eos is 128009) and reduce on device so only
+    # the scalar crosses to the host.
+    n_tokens_total = int((generated_ids[:, 74:] != tokenizer.eos_token_id).sum().item())
+    throughput = n_tokens_total / duration
     avg_seq_len = n_tokens_total / batch_size
-    avg_latency = (end - start) / avg_seq_len
-    duration = end - start
+    avg_latency = duration / avg_seq_len
     print(
         f"Latency: takes {avg_latency * 1000:.2f} ms/token on average for {batch_size} sequences of {avg_seq_len} tokens\n"
         "The reference number for the latency is 30 +- 15 ms/token\n"
@@ -69,17 +109,28 @@ def benchmark(print_output=False):
     return throughput, avg_latency
 
 
-@torch.no_grad()
+@torch.inference_mode()
 def feedforward_no_grad(context_size=512, batch_size=1):
     dims = (batch_size, context_size)
-    input_ids = torch.ones(dims, dtype=torch.int64, device="cuda") * torch.randint(
-        10, 1000, dims, device="cuda"
+    # A single randint call; the former ones * randint launched three
+    # kernels and two temporaries for the same result.
+    # int32 halves the bytes the embedding gather reads (nn.Embedding
+    # accepts int32 indices).
+    input_ids = torch.randint(10, 1000, dims, dtype=torch.int32, device="cuda")
+    # No attention_mask: an explicit all-ones mask pushes FlashAttention-2
+    # into its variable-length branch; without it the dense causal path runs.
+    # Throwaway call so compilation for this shape happens outside the
+    # timed region.
+    model(input_ids=input_ids)
+    start_event = torch.cuda.Event(enable_timing=True)
+    end_event = torch.cuda.Event(enable_timing=True)
+    start_event.record()
+    model(input_ids=input_ids)
+    end_event.record()
+    torch.cuda.synchronize()
+    throughput = (
+        context_size * batch_size / (start_event.elapsed_time(end_event) / 1000)
     )
-    attention_mask = torch.ones(dims, dtype=torch.int64, device="cuda")
-    start = time.time()
-    model(input_ids=input_ids, attention_mask=attention_mask)
-    end = time.time()
-    throughput = context_size * batch_size / (end - start)
     print(
         f"Throughput: feedforward no grad {throughput:.2f} tokens/sec with {context_size} context size and {batch_size} batch size"
     )
@@ -87,29 +138,45 @@ def feedforward_no_grad(context_size=512, batch_size=1):
 
 def backward(context_size=512, batch_size=1):
     dims = (batch_size, context_size)
-    input_ids = torch.ones(dims, dtype=torch.int64, device="cuda") * torch.randint(
-        10, 1000, dims, device="cuda"
-    )
-    attention_mask = torch.ones(dims, dtype=torch.int64, device="cuda")
-    labels = torch.ones(dims, dtype=torch.int64, device="cuda") * torch.randint(
-        10, 30, dims, device="cuda"
+    # int32 ids halve the bytes read by the embedding gather; the labels
+    # stay int64 because the cross-entropy loss requires long targets.
+    input_ids = torch.randint(10, 1000, dims, dtype=torch.int32, device="cuda")
+    labels = torch.randint(10, 30, dims, dtype=torch.int64, device="cuda")
+    # Throwaway forward+backward so compilation for this shape happens
+    # outside the timed region.
+    model(input_ids=input_ids, labels=labels).loss.backward()
+    start_event = torch.cuda.Event(enable_timing=True)
+    mid_event = torch.cuda.Event(enable_timing=True)
+    backward_start_event = torch.cuda.Event(enable_timing=True)
+    end_event = torch.cuda.Event(enable_timing=True)
+    start_event.record()
+    output = model(input_ids=input_ids, labels=labels)
+    mid_event.record()
+    torch.cuda.synchronize()
+    throughput = (
+        context_size * batch_size / (start_event.elapsed_time(mid_event) / 1000)
     )
-    start = time.time()
-    output = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
-    end = time.time()
-    throughput = context_size * batch_size / (end - start)
     print(
         f"Throughput: feedforward {throughput:.2f} tokens/sec with {context_size} context size and {batch_size} batch size"
     )
     loss = output.loss
-    start2 = time.time()
+    # Record right before the backward call so the host-side print above is
+    # not counted as GPU idle time in the backward measurement.
+    backward_start_event.record()
     loss.backward()
-    end2 = time.time()
-    throughput = context_size * batch_size / (end2 - start2)
+    end_event.record()
+    torch.cuda.synchronize()
+    throughput = (
+        context_size
+        * batch_size
+        / (backward_start_event.elapsed_time(end_event) / 1000)
+    )
     print(
         f"Throughput: backward {throughput:.2f} tokens/sec with {context_size} context size and {batch_size} batch size"
     )
-    throughput_total = context_size * batch_size / (end2 - start)
+    throughput_total = (
+        context_size * batch_size / (start_event.elapsed_time(end_event) / 1000)
+    )
     print(
         f"Throughput: total {throughput_total:.2f} tokens/sec with {context_size} context size and {batch_size} batch size"
     )